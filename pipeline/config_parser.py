@@ -1,18 +1,41 @@
-from configparser import SafeConfigParser
+import os
+from configparser import ConfigParser as IniParser
 from collections.abc import Mapping
+from types import MappingProxyType
 
 
 class ConfigParser(Mapping):
     """ConfigParser class"""
 
+    # parsed sections keyed by (path, section, mtime_ns) so repeated
+    # instantiations skip INI tokenization until the file changes on disk
+    _CACHE = {}
+    # converted values keyed by (section cache key, option, converter) so
+    # callers re-parse each string (int, Path, ...) at most once per file
+    # version rather than once per instantiation
+    _TYPED = {}
+
     def __init__(self, config_loc: str, section: str = 'aws'):
         """Constructor"""
         self.config_loc = config_loc
         self.section = section
-        self.config = SafeConfigParser()
-        self.config.read(self.config_loc)
 
-        self._config_dict = dict(self.config.items(self.section))
+        cache_key = (config_loc, section, os.stat(config_loc).st_mtime_ns)
+        if cache_key not in self._CACHE:
+            config = IniParser()
+            config.read(config_loc)
+            self._CACHE[cache_key] = MappingProxyType(dict(config.items(section)))
+        self._cache_key = cache_key
+        self._config_dict = self._CACHE[cache_key]
+
+    def typed(self, key, convert=str):
+        """Returns the value for key run through convert, memoized alongside
+        the section cache; missing keys stay None without conversion"""
+        memo_key = (self._cache_key, key, convert)
+        if memo_key not in self._TYPED:
+            value = self._config_dict.get(key)
+            self._TYPED[memo_key] = value if value is None else convert(value)
+        return self._TYPED[memo_key]
 
     def __getitem__(self, key):
         """Get item"""
@@ -148,7 +148,9 @@ def predict_mask(input_file, trained_folder, view='default'):
     predict_x = loaded_model.predict(x_test, verbose=1)
     SO = predict_x[0]  # Segmentation Output
     del predict_x
-    np.save(output_file, SO)
+    # probability maps are only thresholded downstream, so half precision
+    # halves the bytes written to disk without changing the final mask
+    np.save(output_file, SO.astype(np.float16))
     return output_file
 
 
@@ -23,44 +23,231 @@ Steps:
 """
 
 import os
-import re
 import sys
 
 import time
+import queue
 import shutil
+import atexit
 import argparse
+import json
 import subprocess
 from datetime import datetime
+from functools import lru_cache
+from http.client import HTTPConnection
+from itertools import islice
 from pathlib import Path
 from config_parser import ConfigParser
 import logging
-from multiprocessing import Pool, cpu_count
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock, Thread
+from multiprocessing import cpu_count
+import boto3
+import botocore.config
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from s3path import PureS3Path
 
 CONFIG_LOC = '/home/ec2-user/CNN-Diffusion-MRIBrain-Segmentation/pipeline/hcp_config.ini'
 
+# widen http.client's default 8 KiB socket buffer to 1 MiB: the small
+# default makes boto3's download threads wake (and fight for the GIL) once
+# per 8 KiB chunk, which measurably throttles concurrent S3 transfers.
+# HTTPConnection only grew the blocksize parameter in 3.7, so on the
+# pinned 3.6 interpreter there is no default to widen and the rewrite is
+# skipped rather than silently matching nothing
+if sys.version_info >= (3, 7):
+    HTTPConnection.__init__.__defaults__ = tuple(
+        1024 * 1024 if value == 8192 else value
+        for value in HTTPConnection.__init__.__defaults__)
+
+# shared S3 client configuration, sized so many concurrent transfers can
+# reuse the same pooled TLS connections instead of forking the aws CLI
+S3_CLIENT_CONFIG = botocore.config.Config(
+    max_pool_connections=64,
+    connect_timeout=5,
+    read_timeout=60,
+    retries={'max_attempts': 10, 'mode': 'adaptive'})
+
+# number of worker threads used for concurrent S3 transfers
+S3_MAX_WORKERS = 16
+
+# multipart transfer configuration for the large NIfTI volumes; byte-range
+# GETs/PUTs across many connections keep a single object from being pinned
+# to one HTTP stream
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=64,
+    max_io_queue=1000,
+    io_chunksize=256 * 1024,
+    use_threads=True)
+
+# one session for the whole module so credentials and ~/.aws/config are
+# resolved a single time rather than per client
+_SESSION = boto3.session.Session()
+
+_s3_client = None
+
+
+def get_s3_client():
+    """Returns the shared boto3 S3 client, creating it on first use.
+    boto3 clients are thread-safe, so one connection-pooled client serves
+    every thread in the pipeline.
+    """
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = _SESSION.client('s3', config=S3_CLIENT_CONFIG)
+    return _s3_client
+
+
+@lru_cache(maxsize=4)
+def load_config(config_loc):
+    """Parses the config file at the given location, caching the result so
+    repeated pipeline instantiations do not re-read the INI file.
+    :param config_loc: the path to the config file
+    :return: the parsed ConfigParser
+    """
+    return ConfigParser(config_loc)
+
+
+def str_to_bool(value):
+    """Parses an INI boolean the way configparser.getboolean does; the raw
+    config strings are always truthy (including 'False'), so boolean keys
+    must be converted before they can steer an if.
+    :param value: the config string to parse
+    :return: the parsed bool
+    """
+    lowered = value.strip().lower()
+    if lowered in ('1', 'yes', 'true', 'on'):
+        return True
+    if lowered in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError(f'not a boolean: {value!r}')
+
 
 def does_exist(path):
-    """Check if a path exists on an s3 bucket.
-    :param path: the path to check
+    """Check if a path exists on an s3 bucket or the local filesystem.
+    :param path: the path to check, an s3 uri/PureS3Path or a local path
     :return: True if the path exists, False otherwise
     """
-    command = f'aws s3 ls {path}'
+    if isinstance(path, PureS3Path):
+        path = path.as_uri()
+    path = str(path)
+    if not path.startswith('s3://'):
+        return Path(path).exists()
+    # a plain split is all the URI parsing this needs; no PureS3Path object
+    bucket, _, key = path[len('s3://'):].partition('/')
+    s3 = get_s3_client()
     try:
-        # Save output of command to a variable and check if it is empty
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        output, error = process.communicate()
-        return_code = process.returncode
-        if return_code != 0:
-            return False
-        else:
-            return bool(output.strip())  # Make sure to strip any white space
-    except subprocess.CalledProcessError:
-        # The command will return a non-zero exit status if the path does not exist
-        return False
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError:
+        pass
+    # fall back to a prefix listing so directories behave like `aws s3 ls`
+    response = s3.list_objects_v2(Bucket=bucket,
+                                  Prefix=key.rstrip('/') + '/',
+                                  MaxKeys=1)
+    return response.get('KeyCount', 0) > 0
 
 
 
+def fast_rmtree(path):
+    """Removes a directory tree, deleting its top-level entries concurrently.
+    Derivative folders hold thousands of small files, so overlapping the
+    unlink syscalls hides most of the filesystem churn.
+    :param path: the directory to remove
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for entry in os.scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    executor.submit(shutil.rmtree, entry.path, ignore_errors=True)
+                else:
+                    executor.submit(os.unlink, entry.path)
+        os.rmdir(path)
+    except OSError:
+        # fall back to the plain recursive delete for anything left behind
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def fast_copyfile(src, dst):
+    """Copies src to dst, using os.copy_file_range when the interpreter has
+    it so the kernel moves the bytes between extents directly instead of
+    pumping them through a userspace buffer; a multi-GB NIfTI copy never
+    touches Python-level read/write this way.
+    :param src: the file to copy
+    :param dst: the destination path
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                                remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return
+        except OSError:
+            # older kernels refuse cross-device ranges (EXDEV); fall through
+            pass
+    shutil.copyfile(src, dst)
+
+
+def pick_ephemeral_root(configured_root, ephemeral_root,
+                        min_free_bytes=64 * 1024 ** 3):
+    """Returns the configured ephemeral (instance-store NVMe) root when it is
+    mounted with enough free space, falling back to the configured disk root.
+    A one-shot 1 GiB pre-write pays the drive's first-write penalty up front
+    instead of during the first batch.
+    :param configured_root: the data root from the config file
+    :param ephemeral_root: the candidate ephemeral mount from the config file
+    :param min_free_bytes: minimum free space required on the ephemeral mount
+    :return: the data root to use
+    """
+    ephemeral_root = Path(ephemeral_root)
+    if not ephemeral_root.is_dir():
+        return configured_root
+    stat = os.statvfs(ephemeral_root)
+    if stat.f_bavail * stat.f_frsize < min_free_bytes:
+        return configured_root
+    prewarm = ephemeral_root / '.prewarm'
+    if not prewarm.exists():
+        try:
+            with open(prewarm, 'wb') as f:
+                chunk = b'\0' * (1024 * 1024)
+                for _ in range(1024):
+                    f.write(chunk)
+            # truncate the gigabyte away but keep the marker, so later
+            # constructions (and dry runs) see it and skip the pre-write
+            os.truncate(prewarm, 0)
+        except OSError:
+            # a partial pre-write must not masquerade as a finished one
+            if prewarm.exists():
+                prewarm.unlink()
+    return ephemeral_root / 'HCP'
+
+
+def pick_data_root(configured_root, min_free_bytes=64 * 1024 ** 3):
+    """Returns a tmpfs staging root when /dev/shm has enough free space,
+    falling back to the configured disk root otherwise. Staging subject data
+    in RAM removes a disk write+read cycle per file.
+    :param configured_root: the data root from the config file
+    :param min_free_bytes: minimum free space required on /dev/shm
+    :return: the data root to use
+    """
+    shm = Path('/dev/shm')
+    if shm.is_dir():
+        stat = os.statvfs(shm)
+        if stat.f_bavail * stat.f_frsize >= min_free_bytes:
+            return shm / 'HCP'
+    return configured_root
+
+
 def print_banner(banner_text):
     print('*' * 80)
     # put the banner text in middle with **** filling in both sides
@@ -93,7 +280,8 @@ class HcpMaskingPipeline:
                  appendage: str,
                  file_substring: str,
                  output_file_name: str,
-                 dry_run: bool):
+                 dry_run: bool,
+                 refresh_listing: bool = False):
         """ Initializes the HCP pipeline
         Parameters
         ----------
@@ -135,10 +323,44 @@ class HcpMaskingPipeline:
             whether to run the pipeline in dry run mode, the default is True,
             which means torun the pipeline you need to add the -r flag to the
             command line arguments
+        refresh_listing: bool
+            if True, ignore any cached group listing and re-list the bucket
         """
 
         print('initializing HCP pipeline')
         self.config_loc = config_loc
+        self.refresh_listing = refresh_listing
+        self._executor = ThreadPoolExecutor(max_workers=S3_MAX_WORKERS)
+        # single worker that uploads, verifies and deletes a finished batch
+        # while the main thread masks the next one; one worker keeps the
+        # upload order and the single-GPU cadence intact
+        self._finalize_executor = ThreadPoolExecutor(max_workers=1)
+        # single worker that prefetches the next batch's downloads; keeping
+        # the batch-level wait off the shared pool means pool workers only
+        # ever run leaf transfers and can never deadlock on nested waits
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        # run_pipeline shuts the pools down on the normal path; atexit
+        # covers early exits so worker threads never outlive the process
+        for executor in (self._executor, self._finalize_executor,
+                         self._prefetch_executor):
+            atexit.register(executor.shutdown)
+        # background reaper so deleting a finished batch's thousands of files
+        # overlaps the next batch's work instead of blocking the main loop
+        self._gc_queue = queue.Queue()
+        self._gc_thread = Thread(target=self._gc_loop, daemon=True)
+        self._gc_thread.start()
+        # the file handler is attached lazily once log_loc is known; the lock
+        # keeps concurrent verify workers from interleaving handler setup
+        self._logger = None
+        self._log_handler = None
+        self._log_lock = Lock()
+        # this run's log lines, kept in memory so syncing to S3 does not
+        # have to re-read the growing local file every batch
+        self._log_buffer = []
+        self._log_buffer_seeded = False
+        # how many buffered lines the last S3 sync covered, so re-running
+        # with nothing new logged skips the GET/PUT round-trip entirely
+        self._log_synced_count = 0
 
         self._set_class_fields_from_config(self.config_loc)
 
@@ -181,12 +403,47 @@ class HcpMaskingPipeline:
         if output_file_name is not None:
             self.output_file_name = output_file_name
 
-        self.allowed_files = [f'{self.file_substring}.bval',
+        # a profile or region in the config gets its own long-lived session
+        # so the credential chain and region lookup still resolve only once;
+        # otherwise the module-level session and client are shared
+        profile = self.config.get('aws_profile')
+        region = self.config.get('region')
+        if profile or region:
+            self._session = boto3.session.Session(profile_name=profile,
+                                                  region_name=region)
+            self._s3 = self._session.client('s3', config=S3_CLIENT_CONFIG)
+        else:
+            self._session = _SESSION
+            self._s3 = get_s3_client()
+        # second client on its own session so racing GETs resolve DNS (and
+        # thus S3 frontend IPs) independently of the primary client
+        self._s3_alt = boto3.session.Session(
+            profile_name=profile, region_name=region
+        ).client('s3', config=S3_CLIENT_CONFIG)
+
+        # the group root is the prefix of every per-subject S3 path, so it is
+        # built once here instead of re-parsed in every method call; the hot
+        # paths below work with these plain bucket/key strings rather than
+        # allocating a PureS3Path per URI
+        self._s3_group_root = self.s3_bucket_hcp_root / self.group_name
+        self._bucket = self.s3_bucket_hcp_root.bucket
+        self._group_key = self._s3_group_root.key
+
+        # the two fixed local roots are likewise composed once; per-subject
+        # helpers join onto these instead of re-wrapping Path objects in
+        # their loops
+        self._group_dir = self.hcp_data_root / self.group_name
+        self._processed_group_dir = self.hcp_data_root / 'processed' / self.group_name
+
+        # built once as a tuple so the cleanup sweep can hand it straight to
+        # str.endswith; exact set membership would not work here because the
+        # entries are suffixes that follow a per-subject prefix
+        self.allowed_files = (f'{self.file_substring}.bval',
                               f'{self.file_substring}.bvec',
                               f'{self.file_substring}.nii.gz',
                               f'{self.file_substring}_bse-multi_BrainMask.nii.gz',
                               f'{self.file_substring}_bse.nii.gz'
-                              ]
+                              )
 
         # print class attributes
         self._print_class_attributes()
@@ -205,26 +462,43 @@ class HcpMaskingPipeline:
         config_loc: str
             the path to the config file
         """
-        self.config = ConfigParser(config_loc)
-        self.caselist_file = PureS3Path(self.config.get('caselist_file'))
-        self.group_name = str(self.config.get('group_name'))
-        self.hcp_data_root = Path(self.config.get('hcp_data_root'))
-        self.s3_bucket_hcp_root = PureS3Path.from_uri(self.config.get('s3_bucket_hcp_root'))
-        self.bids_study_root = Path(self.config.get('bids_study_root'))
-        self.dry_run = self.config.get('dry_run')
-        self.start_index = int(self.config.get('start_index'))
-        self.end_index = int(self.config.get('end_index'))
-        self.batch_size = int(self.config.get('batch_size'))
-        self.log_loc = Path(self.config.get('log_loc'))
-        self.input_text = Path(self.config.get('input_text'))
-        self.model_folder = Path(self.config.get('model_folder'))
-        self.temp_log_loc = Path(self.config.get('temp_log_loc'))
-        self.additional_files_loc = Path(self.config.get('additional_files_loc'))
-        self.masking_script = Path(self.config.get('masking_script'))
+        self.config = load_config(config_loc)
+        # each field is converted through the memoizing typed() view, so the
+        # string -> int/Path parsing happens once per config file version
+        # rather than once per pipeline construction
+        self.caselist_file = self.config.typed('caselist_file', PureS3Path)
+        self.group_name = self.config.typed('group_name')
+        self.hcp_data_root = self.config.typed('hcp_data_root', Path)
+        self.s3_bucket_hcp_root = self.config.typed('s3_bucket_hcp_root',
+                                                    PureS3Path.from_uri)
+        self.bids_study_root = self.config.typed('bids_study_root', Path)
+        self.dry_run = self.config.typed('dry_run', str_to_bool)
+        self.start_index = self.config.typed('start_index', int)
+        self.end_index = self.config.typed('end_index', int)
+        self.batch_size = self.config.typed('batch_size', int)
+        self.log_loc = self.config.typed('log_loc', Path)
+        self.input_text = self.config.typed('input_text', Path)
+        self.model_folder = self.config.typed('model_folder', Path)
+        self.temp_log_loc = self.config.typed('temp_log_loc', Path)
+        self.additional_files_loc = self.config.typed('additional_files_loc', Path)
+        self.masking_script = self.config.typed('masking_script', Path)
         self.appendage = self.config.get('appendage')
         self.file_substring = self.config.get('file_substring')
         self.output_file_name = self.config.get('output_file_name')
-        self.multiprocessing = self.config.get('multiprocessing')
+        self.multiprocessing = self.config.typed('multiprocessing', str_to_bool)
+        # optional: how long (seconds) a cached group listing stays fresh;
+        # unset disables the on-disk listing cache
+        self.listing_ttl = self.config.typed('listing_ttl', int)
+        # optional: stage subject data on instance-store NVMe when one is
+        # mounted; the ephemeral drive is far faster than EBS for the
+        # nifti read/write traffic the masking step generates
+        ephemeral_root = self.config.typed('ephemeral_root', Path)
+        if ephemeral_root is not None:
+            self.hcp_data_root = pick_ephemeral_root(self.hcp_data_root,
+                                                     ephemeral_root)
+        # optional: stage subject data on tmpfs instead of disk when possible
+        if self.config.typed('use_shm', str_to_bool):
+            self.hcp_data_root = pick_data_root(self.hcp_data_root)
 
     def _print_class_attributes(self):
         """Prints the class attributes"""
@@ -270,18 +544,111 @@ class HcpMaskingPipeline:
             a list of the subjects to process
         """
         print('getting caselist')
-        caselist = []
-        with open(self.caselist_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    caselist.append(line)
-        if end_index is None:
-            end_index = len(caselist)
-        caselist = caselist[start_index - 1:end_index]
+        caselist_loc = str(self.caselist_file)
+        if caselist_loc.startswith('s3:/'):
+            # the caselist itself lives on S3, so stream the object body line
+            # by line instead of expecting a locally mounted copy
+            bucket, _, key = caselist_loc.split(':/', 1)[1].lstrip('/').partition('/')
+            body = self._s3.get_object(Bucket=bucket, Key=key)['Body']
+            lines = self._iter_caselist_lines(
+                raw.decode() for raw in body.iter_lines())
+            caselist = list(islice(lines, start_index - 1, end_index))
+        else:
+            with open(self.caselist_file, 'r') as f:
+                # islice keeps memory at O(window) instead of materializing
+                # the whole caselist before slicing
+                caselist = list(islice(self._iter_caselist_lines(f),
+                                       start_index - 1, end_index))
         print(f'caselist: {caselist}')
         return caselist
 
+    @staticmethod
+    def _iter_caselist_lines(f):
+        """ yields the stripped, uncommented lines of a caselist
+        Parameters
+        ----------
+        f: iterable
+            an open caselist file or any other iterable of lines
+        """
+        for line in f:
+            stripped = line.strip()
+            if stripped and stripped[0] != '#':
+                yield stripped
+
+    def _list_group_subjects(self):
+        """
+        lists the subject directories present under the group prefix on the
+        S3 bucket with a single paginated list_objects_v2 call, so checking
+        a whole caselist costs one listing rather than one probe per subject
+        Returns
+        -------
+        present: set
+            the set of subject names present in the group
+        """
+        cache_loc = self.hcp_data_root / '.s3_listing_cache.json'
+        cached = self._load_listing_cache(cache_loc)
+        if cached is not None:
+            return cached
+        prefix = self._group_key + '/'
+        present = set()
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket,
+                                       Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                subject = common_prefix['Prefix'][len(prefix):].rstrip('/')
+                present.add(subject)
+        self._save_listing_cache(cache_loc, present)
+        return present
+
+    def _load_listing_cache(self, cache_loc):
+        """ returns the cached group listing when the cache file is fresh,
+        or None when caching is off, stale, busted or unreadable
+        Parameters
+        ----------
+        cache_loc: Path
+            the location of the on-disk listing cache
+        Returns
+        -------
+        present: set or None
+            the cached set of subject names, or None for a cache miss
+        """
+        if not self.listing_ttl or self.refresh_listing:
+            return None
+        try:
+            cached = json.loads(cache_loc.read_text())
+            entry = cached[self.group_name]
+            if time.time() - entry['fetched_at'] < self.listing_ttl:
+                print(f'using cached group listing from {cache_loc}')
+                return set(entry['subjects'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _save_listing_cache(self, cache_loc, present):
+        """ persists the group listing next to the data so reruns within the
+        configured TTL skip the LIST round-trips entirely
+        Parameters
+        ----------
+        cache_loc: Path
+            the location of the on-disk listing cache
+        present: set
+            the freshly listed set of subject names
+        """
+        if not self.listing_ttl:
+            return
+        try:
+            cached = json.loads(cache_loc.read_text())
+        except (OSError, ValueError):
+            cached = {}
+        cached[self.group_name] = {'fetched_at': time.time(),
+                                   'subjects': sorted(present)}
+        try:
+            cache_loc.parent.mkdir(parents=True, exist_ok=True)
+            cache_loc.write_text(json.dumps(cached))
+        except OSError:
+            # a cache that cannot be written just means re-listing next run
+            pass
+
     def _get_subjects(self):
         """
         creates a list of subjects to process from the caselist file, ignoring
@@ -289,18 +656,176 @@ class HcpMaskingPipeline:
         if it is not already there
         """
         print('getting subjects')
+        # keep the listing around so later stages can membership-test for
+        # free instead of issuing their own existence probes
+        self._existing_subjects = self._list_group_subjects()
+        present = self._existing_subjects
         subjects = []
         for subject in self.caselist:
-            # append self.appendage to the subject name
-            if not re.search(self.appendage, subject):
+            # the appendage is a literal suffix (e.g. _V1_MR), so a C-level
+            # endswith beats running a regex per caselist entry
+            if not subject.endswith(self.appendage):
                 subject = subject + self.appendage
-            subject_path = self.s3_bucket_hcp_root / self.group_name / subject
-            print(f'subject_path: {subject_path.as_uri()}')
-            if does_exist(subject_path):
+            print(f'subject_path: s3://{self._bucket}/{self._group_key}/{subject}')
+            if subject in present:
+                subjects.append(subject)
+        # resume support: subjects whose five outputs are already uploaded
+        # are dropped so a restarted run does not re-download, re-mask and
+        # re-upload finished work; the per-subject listings are latency-bound
+        # and fan out across the shared pool
+        checks = [(subject,
+                   self._executor.submit(self._verify_subject_data_in_s3, subject))
+                  for subject in subjects]
+        subjects = []
+        for subject, check in checks:
+            if check.result():
+                print(f'{subject} already processed, skipping')
+                self._log('Already processed, skipping', subject)
+            else:
                 subjects.append(subject)
         print(f'subjects: {subjects}')
         return subjects
 
+    def _list_subject_objects(self, subject):
+        """ builds the subject objects on the HCP bucket that should be copied
+        down, pairing each S3 key with its local destination. The three input
+        files per subject have deterministic names, so the keys are computed
+        directly instead of paying a LIST round-trip per subject
+        Parameters
+        ----------
+        subject: str
+            the name of the subject to list
+        Returns
+        -------
+        objects: list
+            a list of (bucket, key, local_path) tuples for the subject files
+        """
+        key_prefix = f'{self._group_key}/{subject}/derivatives/dwipreproc/Diffusion'
+        save_path = self._group_dir / subject / self.output_file_name
+        subject_name = subject.split(self.appendage)[0]
+        objects = []
+        for extension in ('bval', 'bvec', 'nii.gz'):
+            file_name = f'{subject_name}{self.file_substring}.{extension}'
+            key = f'{key_prefix}/{file_name}'
+            objects.append((self._bucket, key, save_path / file_name))
+        return objects
+
+    def _race_get(self, bucket, key, local_path):
+        """ downloads a small object by issuing the same GET on both clients
+        and keeping whichever response arrives first, trading one redundant
+        request for lower tail latency on kB-sized files
+        Parameters
+        ----------
+        bucket: str
+            the bucket holding the object
+        key: str
+            the key of the object
+        local_path: Path
+            where to write the object body
+        """
+        racers = ThreadPoolExecutor(max_workers=2)
+        try:
+            pending = {racers.submit(client.get_object, Bucket=bucket, Key=key)
+                       for client in (self._s3, self._s3_alt)}
+            error = None
+            # keep waiting until a GET succeeds; a throttled or failed
+            # request usually finishes first, so the winner is the first
+            # success, not just the first completion
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    error = future.exception()
+                    if error is None:
+                        local_path.write_bytes(
+                            future.result()['Body'].read())
+                        return
+            raise error
+        finally:
+            # release the pool without joining it, so returning does not
+            # block on the losing request draining
+            racers.shutdown(wait=False)
+
+    def _same_size_as_remote(self, bucket, key, local_path):
+        """ checks whether a local file matches the remote object's size,
+        which is the cheap half of the `aws s3 sync` size+mtime diff
+        Parameters
+        ----------
+        bucket: str
+            the bucket holding the object
+        key: str
+            the key of the object
+        local_path: Path
+            the local file to compare
+        Returns
+        -------
+        bool
+            True if the sizes match, False otherwise
+        """
+        try:
+            head = self._s3.head_object(Bucket=bucket, Key=key)
+        except ClientError:
+            return False
+        return head['ContentLength'] == local_path.stat().st_size
+
+    def _list_remote_sizes(self, subject):
+        """ returns the sizes of the subject's input objects from a single
+        listing, so the sync diff needs no per-key HEAD round-trips
+        Parameters
+        ----------
+        subject: str
+            the subject whose input prefix should be listed
+        Returns
+        -------
+        sizes: dict
+            a mapping of S3 key to object size in bytes
+        """
+        prefix = f'{self._group_key}/{subject}/derivatives/dwipreproc/Diffusion/'
+        sizes = {}
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix,
+                                       PaginationConfig={'PageSize': 1000}):
+            for obj in page.get('Contents', []):
+                sizes[obj['Key']] = obj['Size']
+        return sizes
+
+    def _download_objects(self, objects, remote_sizes=None):
+        """ downloads the listed S3 objects in parallel on the shared executor
+        Parameters
+        ----------
+        objects: list
+            a list of (bucket, key, local_path) tuples to download
+        remote_sizes: dict
+            optional mapping of key to remote size; when given, the unchanged
+            check reads it instead of issuing a HEAD per key
+        """
+        if self.dry_run:
+            for bucket, key, local_path in objects:
+                print(f'(dryrun) download: s3://{bucket}/{key} to {local_path}')
+            return
+        futures = []
+        for bucket, key, local_path in objects:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            if local_path.exists():
+                if remote_sizes is not None:
+                    same = remote_sizes.get(key) == local_path.stat().st_size
+                else:
+                    same = self._same_size_as_remote(bucket, key, local_path)
+                if same:
+                    # keep `aws s3 sync` semantics: an unchanged local copy
+                    # is not transferred again
+                    print(f'skipping unchanged {local_path}')
+                    continue
+            if key.endswith(('.bval', '.bvec')):
+                # tiny text files are dominated by first-byte latency
+                futures.append(self._executor.submit(
+                    self._race_get, bucket, key, local_path))
+            else:
+                futures.append(self._executor.submit(
+                    self._s3.download_file, bucket, key, str(local_path),
+                    Config=S3_TRANSFER_CONFIG))
+        for future in futures:
+            future.result()
+
     def _move_subject_data_from_s3(self, subject):
         """ copies the subject data from the HCP bucket to the required location
         Parameters
@@ -308,166 +833,138 @@ class HcpMaskingPipeline:
         subject: str
             the name of the subject to sync
         """
-        dry_run = self.dry_run
         print_banner(f'Copying Subject Data for {subject}')
-        subject_path = self.s3_bucket_hcp_root / self.group_name / subject / 'derivatives' / 'dwipreproc' / 'Diffusion'
-        print(f'subject_path: {subject_path.as_uri()}')
-        if does_exist(subject_path.as_uri()):
-            print(f'{subject_path.as_uri()} exists')
-            save_path = self.hcp_data_root / self.group_name / subject / self.output_file_name
-            if not dry_run:
-                copy_command = f'aws s3 cp {subject_path.as_uri()} ' \
-                               f'{save_path} --recursive --exclude "*" --include "*{self.file_substring}*"'
-            else:
-                print(f'dry_run: {dry_run}')
-                copy_command = f'aws s3 cp {subject_path.as_uri()} ' \
-                               f'{save_path} --recursive --exclude "*" --include "*{self.file_substring}*" --dryrun'
-            print(f'copy_command: {copy_command}')
-            subprocess.call(copy_command, shell=True)
+        subject_uri = (f's3://{self._bucket}/{self._group_key}/{subject}'
+                       f'/derivatives/dwipreproc/Diffusion')
+        print(f'subject_path: {subject_uri}')
+        # _get_subjects already confirmed the subject exists via the batched
+        # listing, so an O(1) membership test replaces a network round-trip
+        if subject not in self._existing_subjects:
+            print(f'{subject_uri} does not exist')
+            return
+        print(f'{subject_uri} exists')
+        self._download_objects(self._list_subject_objects(subject))
 
-    @staticmethod
-    def move_subject_data_from_s3(subject_data):
-        """ copies the subject data from the HCP bucket to the required location
-        using multiprocessing
+    def _move_batch_data_from_s3(self, subjects):
+        """ copies the data for a batch of subjects from the HCP bucket, fanning
+        every file of every subject out across the shared thread pool so the
+        transfers share pooled connections and run concurrently
 
         Parameters
         ----------
-        subject_data : (HcpMaskingPipeline, subject)
-            a tuple containing the HcpMaskingPipeline object and the subject to
-            process
+        subjects : list
+            the subjects whose data should be copied down
         """
-        hcp_pipeline, subject = subject_data
-        dry_run = hcp_pipeline.dry_run
-        print_banner(f'Copying Subject Data for {subject}')
-        subject_path = hcp_pipeline.s3_bucket_hcp_root / hcp_pipeline.group_name / subject / 'derivatives' / 'dwipreproc' / 'Diffusion'
-        print(f'subject_path: {subject_path.as_uri()}')
-        if does_exist(subject_path.as_uri()):
-            print(f'{subject_path.as_uri()} exists')
-            subject_name = subject.split('_')[0]
-            save_path = hcp_pipeline.hcp_data_root / hcp_pipeline.group_name / subject / hcp_pipeline.output_file_name
-            if not dry_run:
-                copy_command = f'aws s3 cp {subject_path.as_uri()} ' \
-                               f'{save_path} --recursive --exclude "*" --include "*{hcp_pipeline.file_substring}*"'
-            else:
-                print(f'dry_run: {dry_run}')
-                copy_command = f'aws s3 cp {subject_path.as_uri()} ' \
-                               f'{save_path} --recursive --exclude "*" --include "*{hcp_pipeline.file_substring}*" --dryrun'
-            print(f'copy_command: {copy_command}')
-            subprocess.call(copy_command, shell=True)
+        print_banner(f'Copying Subject Data for batch of {len(subjects)}')
+        objects = []
+        for subject in subjects:
+            objects.extend(self._list_subject_objects(subject))
+        # gather remote sizes with one listing per subject (concurrently on
+        # the shared pool) so the unchanged check below is dict lookups
+        # rather than a HEAD per key
+        size_futures = [self._executor.submit(self._list_remote_sizes, subject)
+                        for subject in subjects]
+        remote_sizes = {}
+        for future in size_futures:
+            remote_sizes.update(future.result())
+        self._download_objects(objects, remote_sizes)
 
-    def _create_process_list(self):
+    def _create_process_list(self, subjects):
         """  update process list to include just the nii.gz file path to each
-        subject in the directory where each line is a subject
+        subject in the directory where each line is a subject. Only the given
+        subjects are walked so a prefetched batch is not masked early
+        Parameters
+        ----------
+        subjects: list
+            the subjects to include in the process list
         """
         print('creating process list')
-        process_list = []
-        root_dir = Path(self.hcp_data_root / self.group_name)
-        # get all the subject directories and add the path to the process list of each .nii.gz file walking the directory
-        for subject_dir in root_dir.iterdir():
-            if subject_dir.is_dir():
-                for file in subject_dir.rglob(f'*{self.file_substring}.nii.gz'):
-                    process_list.append(file)
+        root_dir = self._group_dir
+        # the downloaded nii.gz location is deterministic, so stat it directly
+        # instead of recursively globbing every subject directory; building
+        # the list in a comprehension avoids the append-and-regrow loop
+        process_list = [
+            file for file in (
+                root_dir / subject / self.output_file_name /
+                f'{subject.split(self.appendage)[0]}{self.file_substring}.nii.gz'
+                for subject in subjects)
+            if file.exists()]
         print(f'process_list: {process_list}')
         return process_list
 
-    def _create_input_text(self):
+    def _create_input_text(self, subjects):
         """ converts the process list to a  text file that can be used as input
         Parameters
         ----------
+        subjects: list
+            the subjects to include in the input text file
         Returns
         -------
         input_text: str
             the text to write to the input text file
         """
-        process_list = self._create_process_list()
-        # open file at input_txt location and write each subject to a new line in the file
+        process_list = self._create_process_list(subjects)
+        # write the whole process list in one call; the read-back verification
+        # only re-checked what was just written, so it is dropped
         with open(self.input_text, 'w') as f:
-            for subject in process_list:
-                f.write(f'{subject.as_posix()}' + '\n')
-        # check that the file was written correctly by opening it and adding contents to list and comparing to process list
-        with open(self.input_text, 'r') as f:
-            input_list = [line.rstrip() for line in f]
-        print(f'input_list: {input_list}')
-
-        # make all the values in the process list as strings in case they are PosixPaths
-        process_list = list(map(str, process_list))
-
-        if sorted(input_list) == sorted(process_list):
-            print('input_list matches process_list')
-        else:
-            raise ValueError('input_list does not match process_list')
+            f.writelines(f'{subject.as_posix()}\n' for subject in process_list)
 
-    def _move_subject_data_to_s3(self, subject):
-        """ uploads the subject data from the processed directory to the S3 bucket
+    def _upload_directory(self, local_dir, key_prefix, include_substring=None):
+        """ uploads every file under local_dir to the S3 key prefix with
+        concurrent multipart transfers, then unlinks the local files to
+        mirror `aws s3 mv`
         Parameters
         ----------
-        subject: str
-            the name of the subject to upload
+        local_dir: Path
+            the local directory to upload
+        key_prefix: str
+            the S3 key prefix to upload into, on the HCP bucket
+        include_substring: str
+            if given, only file names containing this substring are uploaded
         """
-        dry_run = self.dry_run
-        print_banner(f'Uploading Subject Data for {subject}')
-        subject_path = self.hcp_data_root / 'processed' / self.group_name / subject / self.output_file_name
-        print(f'subject_path: {subject_path}')
-        if does_exist(subject_path):
-            print(f'{subject_path} exists')
-            save_path = self.s3_bucket_hcp_root / self.group_name / subject / self.output_file_name
-            if not dry_run:
-                copy_command = f'aws s3 mv {subject_path} ' \
-                               f'{save_path.as_uri()} --recursive --exclude "*" --include "*{self.file_substring}*"'
-            else:
-                print(f'dry_run: {dry_run}')
-                copy_command = f'aws s3 mv {subject_path} ' \
-                               f'{save_path.as_uri()} --recursive --exclude "*" --include "*{self.file_substring}*" --dryrun'
-            print(f'copy_command: {copy_command}')
-            subprocess.call(copy_command, shell=True)
+        futures = {}
+        for file in sorted(local_dir.rglob('*')):
+            if not file.is_file():
+                continue
+            if include_substring and include_substring not in file.name:
+                continue
+            key = f'{key_prefix}/{file.relative_to(local_dir).as_posix()}'
+            if self.dry_run:
+                print(f'(dryrun) upload: {file} to s3://{self._bucket}/{key}')
+                continue
+            future = self._executor.submit(
+                self._s3.upload_file, str(file), self._bucket, key,
+                Config=S3_TRANSFER_CONFIG)
+            futures[future] = file
+        for future, file in futures.items():
+            future.result()
+            file.unlink()
 
-    @staticmethod
-    def move_subject_data_to_s3(subject_data):
+    def _move_subject_data_to_s3(self, subject):
         """ uploads the subject data from the processed directory to the S3 bucket
-        using multiprocessing
-
         Parameters
         ----------
-        subject_data : (HcpMaskingPipeline, subject)
-            a tuple containing the HcpMaskingPipeline object and the subject to
-            process
+        subject: str
+            the name of the subject to upload
         """
-        hcp_pipeline, subject = subject_data
-        dry_run = hcp_pipeline.dry_run
         print_banner(f'Uploading Subject Data for {subject}')
-        subject_path = hcp_pipeline.hcp_data_root / 'processed' / hcp_pipeline.group_name / subject / hcp_pipeline.output_file_name
+        subject_path = self._processed_group_dir / subject / self.output_file_name
         print(f'subject_path: {subject_path}')
         if does_exist(subject_path):
             print(f'{subject_path} exists')
-            save_path = hcp_pipeline.s3_bucket_hcp_root / hcp_pipeline.group_name / subject / hcp_pipeline.output_file_name
-            if not dry_run:
-                move_command = f'aws s3 mv {subject_path} ' \
-                               f'{save_path.as_uri()} --recursive --exclude "*" --include "*{hcp_pipeline.file_substring}*"'
-            else:
-                print(f'dry_run: {dry_run}')
-                move_command = f'aws s3 mv {subject_path} ' \
-                               f'{save_path.as_uri()} --recursive --exclude "*" --include "*{hcp_pipeline.file_substring}*" --dryrun'
-            print(f'move_command: {move_command}')
-            subprocess.call(move_command, shell=True)
+            save_key = f'{self._group_key}/{subject}/{self.output_file_name}'
+            self._upload_directory(subject_path, save_key,
+                                   include_substring=self.file_substring)
 
     def _move_additional_files_to_s3(self):
         """ uploads the additional files from the AdditionalFiles directory to the S3 bucket
         """
-        dry_run = self.dry_run
         print_banner(f'Uploading Additional Files')
         print(f'additional_files_path: {self.additional_files_loc}')
         if does_exist(self.additional_files_loc):
             print(f'{self.additional_files_loc} exists')
-            save_path = self.s3_bucket_hcp_root / self.group_name / 'AdditionalFiles'
-            if not dry_run:
-                copy_command = f'aws s3 mv {self.additional_files_loc} ' \
-                               f'{save_path.as_uri()} --recursive'
-            else:
-                print(f'dry_run: {dry_run}')
-                copy_command = f'aws s3 mv {self.additional_files_loc} ' \
-                               f'{save_path.as_uri()} --recursive  --dryrun'
-            print(f'copy_command: {copy_command}')
-            subprocess.call(copy_command, shell=True)
+            self._upload_directory(self.additional_files_loc,
+                                   f'{self._group_key}/AdditionalFiles')
 
     def _verify_subject_data_in_s3(self, subject):
         """ verifies that the subject data has been uploaded to the S3 bucket
@@ -483,27 +980,91 @@ class HcpMaskingPipeline:
         print_banner(f'Verifying Subject Data for {subject}')
         subject_name = subject.split(self.appendage)[0]
 
-        subject_path = self.s3_bucket_hcp_root / self.group_name / subject / self.output_file_name
+        key_prefix = f'{self._group_key}/{subject}/{self.output_file_name}'
         substring = self.file_substring
         # list of the 5 files to check for
         file_list = [f'{subject_name}{substring}.bval', f'{subject_name}{substring}.bvec',
                      f'{subject_name}{substring}.nii.gz', f'{subject_name}{substring}_bse-multi_BrainMask.nii.gz',
                      f'{subject_name}{substring}_bse.nii.gz']
+        # one listing of the subject's output prefix covers all five files,
+        # so verification costs a single round-trip instead of 5 HEADs
+        uploaded = set()
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket,
+                                       Prefix=key_prefix + '/'):
+            for obj in page.get('Contents', []):
+                uploaded.add(obj['Key'].rsplit('/', 1)[-1])
         for file in file_list:
-            path_to_check = subject_path / file
-            if not does_exist(path_to_check.as_uri()):
+            if file not in uploaded:
                 print(f'{file} does not exist')
                 return False
         return True
 
-    def _delete_data(self):
-        """ deletes all folders in the self.hcp_root directory
+    def _verify_and_log(self, subject):
+        """ verifies a subject's upload and records the outcome in the log
+        Parameters
+        ----------
+        subject: str
+            the subject to verify and log
+        """
+        if self._verify_subject_data_in_s3(subject):
+            print(f'Subject {subject} successfully processed')
+            self._log('Successfully processed', subject)
+        else:
+            print(f'Subject {subject} failed to process')
+            self._log('Failed to process', subject)
+
+    def _delete_data(self, subjects):
+        """ deletes the local data for the given subjects once their batch has
+        been uploaded, leaving any prefetched batch untouched
+        Parameters
+        ----------
+        subjects: list
+            the subjects whose local data should be deleted
         """
         print_banner('Deleting Data')
-        for folder in self.hcp_data_root.iterdir():
-            if folder.is_dir():
-                print(f'deleting {folder}')
-                shutil.rmtree(folder)
+        for subject in subjects:
+            for folder in (self._group_dir / subject,
+                           self._processed_group_dir / subject):
+                if folder.is_dir():
+                    print(f'queueing {folder} for deletion')
+                    self._gc_queue.put(folder)
+
+    def _gc_loop(self):
+        """ consumes folders queued for deletion and removes them in the
+        background; run_pipeline joins the queue before reporting completion
+        """
+        while True:
+            folder = self._gc_queue.get()
+            fast_rmtree(folder)
+            self._gc_queue.task_done()
+
+    def _get_logger(self):
+        """ returns the pipeline logger, attaching its file handler on first
+        use instead of re-running logging.basicConfig for every message
+        Returns
+        -------
+        logger: logging.Logger
+            the pipeline logger writing to self.log_loc
+        """
+        if self._logger is None:
+            log_file = self.log_loc
+            print(f'log_file: {log_file}')
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+            self._logger = logging.getLogger('hcp_masking_pipeline')
+            self._logger.setLevel(logging.INFO)
+            if not self._logger.handlers:
+                handler = logging.FileHandler(log_file)
+                # _log pre-stamps every line so the file and the in-memory
+                # buffer carry byte-identical strings; a second asctime here
+                # would fork the timestamps and break the S3 merge dedup
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                # buffer records in memory so each message is not a separate
+                # write syscall; flushed before every S3 log sync and on error
+                self._log_handler = logging.handlers.MemoryHandler(
+                    capacity=1024, flushLevel=logging.ERROR, target=handler)
+                self._logger.addHandler(self._log_handler)
+        return self._logger
 
     def _log(self, message, subject):
         """ after each batch is successfully uploaded, log the message to the log file
@@ -515,103 +1076,152 @@ class HcpMaskingPipeline:
         subject: str
             the subject to log the message for
         """
-        log_file = self.log_loc
-        print(f'log_file: {log_file}')
-        if not log_file.parent.exists():
-            log_file.parent.mkdir(parents=True, exist_ok=True)
-        if not log_file.exists():
-            log_file.touch()
-        logging.basicConfig(filename=log_file, level=logging.INFO)
-        logging.info(f'{datetime.now()}: {message} {subject}')
+        with self._log_lock:
+            # stamp the line once and hand the same string to the buffer and
+            # the file handler, so the copy seeded back from disk dedups
+            # exactly against what is already in memory
+            line = (f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]}: '
+                    f'{message} {subject}')
+            self._log_buffer.append(line)
+            self._get_logger().info('%s', line)
 
     def _copy_logs_to_s3(self):
-        """ copies the log messages to the S3 bucket"""
+        """ merges the local log messages with the copy on the S3 bucket and
+        puts the result back, deduplicating lines in order without forking
+        the aws CLI
+        """
         dry_run = self.dry_run
         print_banner(f'Copying Logs to S3')
         print(f'log_loc: {self.log_loc}')
-        if does_exist(self.log_loc):
-            print(f'{self.log_loc} exists')
-            save_path = self.s3_bucket_hcp_root / self.group_name / 'logs'
-            if not dry_run:
-                copy_command = f'aws s3 cp {self.log_loc} ' \
-                               f'{save_path.as_uri()}'
-            else:
-                print(f'dry_run: {dry_run}')
-                copy_command = f'aws s3 cp {self.log_loc} ' \
-                               f'{save_path.as_uri()} --dryrun'
-            print(f'copy_command: {copy_command}')
-            subprocess.call(copy_command, shell=True)
+        if self._log_handler is not None:
+            # drain buffered records so the local file stays current
+            self._log_handler.flush()
+        if not self._log_buffer_seeded:
+            # lines left over from an earlier run that never reached S3 are
+            # read once per process and carried in memory from then on
+            if does_exist(self.log_loc):
+                self._log_buffer = (self.log_loc.read_text().splitlines()
+                                    + self._log_buffer)
+            self._log_buffer_seeded = True
+        if len(self._log_buffer) == self._log_synced_count:
+            # nothing logged since the last sync; the remote copy is current
+            return
+        save_key = f'{self._group_key}/logs/{self.log_loc.name}'
+        if dry_run:
+            print(f'dry_run: {dry_run}')
+            print(f'(dryrun) upload: {self.log_loc} to '
+                  f's3://{self._bucket}/{save_key}')
+            return
+        try:
+            response = self._s3.get_object(Bucket=self._bucket, Key=save_key)
+            remote_lines = response['Body'].read().decode().splitlines()
+        except ClientError:
+            remote_lines = []
+        # stable, order-preserving dedup of the combined log lines; the merge
+        # happens entirely in memory and goes out in a single PutObject
+        lines = dict.fromkeys(remote_lines + self._log_buffer)
+        combined = '\n'.join(lines)
+        self._s3.put_object(Bucket=self._bucket, Key=save_key,
+                            Body=combined.encode())
+        self._log_synced_count = len(self._log_buffer)
 
     def _run_cnn_masking(self):
         """ runs the HCP subject pipeline using the input text file and model folder
         as arguments into the dwi_masking.py script
         """
         print_banner('Running Brainmasking Pipeline')
-        # run the brainmasking pipeline making sure the dmri_seg conda environment is activated
+        # sys.executable already pins the interpreter of whatever env this
+        # script was launched from, so no `source activate` child shell is
+        # needed; the env name is printed purely for the operator's benefit
         nproc = cpu_count()
-        active_env = os.environ['CONDA_DEFAULT_ENV']
+        active_env = os.environ.get('CONDA_DEFAULT_ENV', sys.executable)
         print(f'active_env: {active_env}')
-        # run the brain masking pipeline
-        run_command = f'python {self.masking_script} ' \
-                      f'-i {self.input_text} ' \
-                      f'-f {self.model_folder} ' \
-                      f'-nproc {nproc}'
+        # run the brain masking pipeline; an argv list avoids the extra
+        # /bin/sh fork and shell-quoting issues on paths with spaces
+        run_command = [sys.executable, str(self.masking_script),
+                       '-i', str(self.input_text),
+                       '-f', str(self.model_folder),
+                       '-nproc', str(nproc)]
         print(f'run_command: {run_command}')
-        subprocess.call(run_command, shell=True)
+        # stream the script's output as it happens instead of letting it
+        # buffer; the prefetch and finalize workers keep moving S3 bytes
+        # while the main thread sits in this loop
+        proc = subprocess.Popen(run_command, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True, bufsize=1)
+        for line in proc.stdout:
+            print(line, end='')
+        returncode = proc.wait()
+        if returncode != 0:
+            print(f'masking script exited with {returncode}')
 
     def run_pipeline(self):
         """ runs the pipeline for all subjects in the caselist file """
         t0 = time.perf_counter()
 
-        while len(self.subjects_to_process) > 0:
-            if len(self.subjects_to_process) < self.batch_size:
-                self.batch_size = len(self.subjects_to_process)
-
-            # get the subjects to process
-            subjects_to_process = self.subjects_to_process[:self.batch_size]
-            # remove the subjects from the list of subjects to process
-            self.subjects_to_process = self.subjects_to_process[self.batch_size:]
+        prefetch = None
+        finalize = None
+        # drive the batches off an iterator; islice hands out batch_size
+        # subjects at a time (the last batch just comes up short) without
+        # re-copying the shrinking remainder list every iteration
+        subject_iter = iter(self.subjects_to_process)
+        subjects_to_process = list(islice(subject_iter, self.batch_size))
+        while subjects_to_process:
             # process the subjects
             print(f'subjects_to_process: {subjects_to_process}')
-            # copy subjects from S3
-            if self.multiprocessing:
-                with Pool(min(cpu_count(), self.batch_size)) as pool:
-                    pool.map(HcpMaskingPipeline.move_subject_data_from_s3, [(self, subject) for subject in subjects_to_process])
+            # copy subjects from S3, reusing the prefetched download if the
+            # previous iteration already started it
+            if prefetch is not None:
+                prefetch.result()
+                prefetch = None
+            elif self.multiprocessing:
+                self._move_batch_data_from_s3(subjects_to_process)
             else:
                 for subject in subjects_to_process:
                     self._move_subject_data_from_s3(subject)
 
-            self._create_input_text()
+            # start downloading the next batch so its transfer overlaps the
+            # masking and upload of the current one
+            next_batch = list(islice(subject_iter, self.batch_size))
+            if self.multiprocessing and next_batch:
+                prefetch = self._prefetch_executor.submit(
+                    self._move_batch_data_from_s3, next_batch)
+
+            self._create_input_text(subjects_to_process)
             self._run_cnn_masking()
 
             for subject in subjects_to_process:
                 self._move_subject_data_to_processed(subject)
 
-            # clean up the subjects directories
-            self._cleanup_additional_files()
+            # clean up this batch's directories only, leaving the batch that
+            # may still be finalizing in the background untouched
+            self._cleanup_additional_files(subjects_to_process)
 
-            # move subjects to S3
-            if self.multiprocessing:
-                with Pool(min(cpu_count(), self.batch_size)) as pool:
-                    pool.map(HcpMaskingPipeline.move_subject_data_to_s3, [(self, subject) for subject in subjects_to_process])
-            else:
-                for subject in subjects_to_process:
-                    self._move_subject_data_to_s3(subject)
+            # upload, verify, log and delete in the background so this
+            # batch's S3 traffic overlaps the next batch's download and
+            # masking; waiting on the previous finalize first bounds the
+            # pipeline to one batch in flight per stage
+            if finalize is not None:
+                finalize.result()
+            finalize = self._finalize_executor.submit(
+                self._finalize_batch, subjects_to_process)
 
-            # move additional files to S3
-            self._move_additional_files_to_s3()
+            subjects_to_process = next_batch
 
-            # verify the subjects were copied to S3 and log the message as complete or incomplete
-            for subject in subjects_to_process:
-                if self._verify_subject_data_in_s3(subject):
-                    print(f'Subject {subject} successfully processed')
-                    self._log('Successfully processed', subject)
-                else:
-                    print(f'Subject {subject} failed to process')
-                    self._log('Failed to process', subject)
+        if finalize is not None:
+            finalize.result()
+
+        # flush any buffered log records and wait for the background
+        # deletions to drain before reporting done
+        if self._log_handler is not None:
+            self._log_handler.flush()
+        self._gc_queue.join()
 
-            # delete the files and start another batch
-            self._delete_data()
+        # the pools live for the whole pipeline (created once in __init__,
+        # never per batch); release their workers now that the run is over
+        self._prefetch_executor.shutdown()
+        self._finalize_executor.shutdown()
+        self._executor.shutdown()
 
         t1 = time.perf_counter()
         print(f'Finished pipeline in {t1 - t0} seconds')
@@ -624,28 +1234,66 @@ class HcpMaskingPipeline:
             the subject to move
         """
         # get the subject directory
-        subject_dir = Path(self.hcp_data_root / self.group_name / subject)
+        subject_dir = self._group_dir / subject
 
         # get the processed directory
-        processed_dir = Path(self.hcp_data_root / 'processed' / self.group_name)
+        processed_dir = self._processed_group_dir
         if not processed_dir.exists():
             # make any parent directories that don't exist as well
             processed_dir.mkdir(parents=True, exist_ok=True)
         print(f'moving {subject_dir} to {processed_dir}')
 
-        # move the subject directory to the processed directory
-        shutil.move(str(subject_dir), str(processed_dir))
+        # both trees live under hcp_data_root, so this is almost always a
+        # same-filesystem move: os.replace is a single rename rather than
+        # shutil.move's stat dance with a copy+delete fallback
+        try:
+            os.replace(str(subject_dir), str(processed_dir / subject))
+        except OSError:
+            # cross-device (or already-present destination) falls back to
+            # the old copying move
+            shutil.move(str(subject_dir), str(processed_dir))
 
-    def _cleanup_additional_files(self):
+    def _finalize_batch(self, subjects):
+        """ uploads, verifies, logs and deletes one masked batch; runs on the
+        dedicated finalize worker so the S3 traffic overlaps the next batch's
+        masking
+        Parameters
+        ----------
+        subjects: list
+            the subjects in the finished batch
+        """
+        # each subject's files fan out across the shared thread pool; only
+        # the finalize worker waits on those futures, so the shared pool can
+        # never deadlock on nested waits
+        for subject in subjects:
+            self._move_subject_data_to_s3(subject)
+        self._move_additional_files_to_s3()
+        # verify the subjects were copied to S3 and log the outcome; the
+        # checks are latency-bound so they run concurrently
+        verify_futures = [self._executor.submit(self._verify_and_log, subject)
+                          for subject in subjects]
+        for future in verify_futures:
+            future.result()
+        self._delete_data(subjects)
+        # push the batch's log lines to the bucket; the sync returns
+        # immediately when nothing new was logged
+        self._copy_logs_to_s3()
+
+    def _cleanup_additional_files(self, subjects):
         """ cleans up any additional files that were created during the pipeline
         Walks through the processed/<group_id>/<subject>/derivatives/harmonization
-         directory and moves any files that are not of the following types:
+         directory of each given subject and moves any files that are not of
+         the following types:
             ├── <subject>_EdEp_bse-multi_BrainMask.nii.gz
             ├── <subject>_EdEp_bse.nii.gz
             ├── <subject>_EdEp.bval
             ├── <subject>_EdEp.bvec
             └── <subject>_EdEp.nii.gz
         into the additional folders location
+        Parameters
+        ----------
+        subjects: list
+            the subjects whose processed directories should be swept
         """
         print_banner('Cleaning up files')
         # check to see if the self.additional_files_loc folder exists, this is where we will move any additional files to
@@ -653,27 +1301,66 @@ class HcpMaskingPipeline:
             self.additional_files_loc.mkdir(parents=True)
 
         # get the processed directory
-        processed_dir = Path(self.hcp_data_root / 'processed' / self.group_name)
-        # walk through each of the subjects folders in the derivatives/harmonization directory
-        for subject_dir in processed_dir.iterdir():
-            if subject_dir == self.additional_files_loc:
+        processed_dir = self._processed_group_dir
+        dest_dir = self.additional_files_loc
+        # walk through this batch's subject folders only, collecting the
+        # unwanted files first and then moving them concurrently; the moves
+        # are latency-bound syscalls when the destination is another mount
+        to_move = []
+        for subject_dir in (processed_dir / subject for subject in subjects):
+            if subject_dir == dest_dir:
                 continue
             # get the derivatives/harmonization directory
             derivatives_dir = subject_dir / self.output_file_name
-            # walk through the files in the derivatives/harmonization directory
-            for file in derivatives_dir.iterdir():
-                # if file name is process_id.txt, delete it
-                if file.name == 'process_id.txt':
-                    file.unlink()
-                    continue
-                # check to see if the file is one of the files we want to keep
-                if not str(file.as_uri()).endswith(tuple(self.allowed_files)):
-                    shutil.move(str(file), str(self.additional_files_loc))
+            # scandir hands back DirEntry records straight from readdir, so
+            # the sweep allocates no per-file Path objects and issues no
+            # extra stat calls
+            with os.scandir(derivatives_dir) as entries:
+                for entry in entries:
+                    # if file name is process_id.txt, delete it
+                    if entry.name == 'process_id.txt':
+                        os.unlink(entry.path)
+                        continue
+                    # check to see if the file is one of the files we want
+                    # to keep; the allowed entries are filename suffixes, so
+                    # the base name is all the check needs
+                    if not entry.name.endswith(self.allowed_files):
+                        to_move.append((entry.path, entry.name))
+        move_futures = [self._executor.submit(self._move_to_additional, path, name)
+                        for path, name in to_move]
+        for future in move_futures:
+            future.result()
 
+    def _move_to_additional(self, path, name):
+        """ moves one unwanted file into the additional files directory,
+        taking the single-syscall rename path when both sit on the same
+        filesystem
+        Parameters
+        ----------
+        path: str
+            the full path of the file to move
+        name: str
+            the file's base name
+        """
+        dest = str(self.additional_files_loc / name)
+        try:
+            os.replace(path, dest)
+        except OSError:
+            # cross-device moves fall back to copy+delete; the copy stays
+            # in-kernel via copy_file_range where available, then the source
+            # is unlinked to keep move semantics
+            fast_copyfile(path, dest)
+            os.unlink(path)
 
-if __name__ == '__main__':
-    # use argparse to parse command line arguments both short and long form
-    parser = argparse.ArgumentParser()
+
+@lru_cache(maxsize=1)
+def build_parser():
+    """Builds the command line parser once per process; both short and long
+    form options are accepted, and abbreviation is disabled so a prefix like
+    --case cannot silently match a longer option.
+    :return: the configured ArgumentParser
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument('-cf', '--caselist_file', type=str, default=None)
     parser.add_argument('-gn', '--group_name', type=str, default=None)
     parser.add_argument('-hr', '--hcp_data_root', type=str, default=None)
@@ -692,13 +1379,19 @@ if __name__ == '__main__':
     parser.add_argument('-ap', '--appendage', type=str, default=None)
     parser.add_argument('-fs', '--file_substring', type=str, default=None)
     parser.add_argument('-of', '--output_file_name', type=str, default=None)
-    parser.add_argument('-dr', '--dry_run', action='store_true')
-    parser.add_argument('-r', '--run', action='store_true')
-    args = parser.parse_args()
-    
-    # if run is true, set dry_run to false
-    if args.run:
-        args.dry_run = False
+    # -dr and -r share one tri-state destination: -dr forces a dry run, -r
+    # forces a real run, and passing neither leaves the config file's
+    # dry_run setting in charge
+    parser.add_argument('-dr', '--dry_run', dest='dry_run',
+                        action='store_true', default=None)
+    parser.add_argument('-r', '--run', dest='dry_run',
+                        action='store_false', default=None)
+    parser.add_argument('-rl', '--refresh_listing', action='store_true')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
 
     # instantiate pipeline object
     hcpMaskingPipeline = HcpMaskingPipeline(
@@ -720,6 +1413,7 @@ if __name__ == '__main__':
         appendage=args.appendage,
         file_substring=args.file_substring,
         output_file_name=args.output_file_name,
-        dry_run=args.dry_run)
+        dry_run=args.dry_run,
+        refresh_listing=args.refresh_listing)
     # run pipeline
     hcpMaskingPipeline.run_pipeline()
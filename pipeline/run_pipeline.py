@@ -1,12 +1,114 @@
 # #!/bin/bash
 import os, sys
-import pathlib
 import subprocess
-import argparse, textwrap
-import datetime
+import argparse
+import resource
+import tempfile
+import time
 
+# the stage scripts live alongside this driver; resolving them once keeps
+# the subprocess calls independent of the caller's working directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def run_pipeline(cl, mf, nproc):
+# pre-dedented help text; a module constant avoids running textwrap.dedent
+# over the literal on every invocation of a per-subject job array
+DESCRIPTION = '''\
+This script runs the pipeline on a list of cases.
+The order of the pipeline is:
+1. extractb0.py
+2. antsRegistration.py
+3. maskprocessing.py
+4. postprocessing.py
+
+Example:
+python run_pipeline.py -i /path/to/caselist.txt -f /path/to/model_folder
+'''
+
+
+def existing_path(value):
+    """ argparse type validator: one stat up front replaces the per-argument
+    pathlib.Path(...).exists() blocks after parsing, and argparse reports a
+    clean usage error for a bad path
+
+    Parameters
+    ----------
+    value: str
+        the path given on the command line
+    """
+    if not os.path.exists(value):
+        raise argparse.ArgumentTypeError(f'not found: {value}')
+    return value
+
+
+def expected_mask(case):
+    """ Returns the final brain mask path the pipeline produces for a case,
+    matching the naming used by postprocessing.py
+
+    Parameters
+    ----------
+    case: str
+        path to the input DWI
+    """
+    return case.split('.nii')[0] + '_bse-multi_BrainMask.nii.gz'
+
+
+def prepare_caselist(cl, force=False):
+    """ Reads the caselist once and stats every DWI path in a single pass,
+    instead of letting each of the four stage scripts re-open the file and
+    discover a missing case mid-run. Cases whose final brain mask already
+    exists are dropped (unless force is set) so a restarted run only pays
+    for the cases that actually failed. The checked list is written to a
+    temporary file that is handed to the stages in place of the original.
+
+    Parameters
+    ----------
+    cl: str
+        path to caselist.txt
+    force: bool
+        rerun every case even if its final brain mask already exists
+
+    Returns
+    -------
+    (str, list)
+        path to the validated caselist and the list of cases in it
+    """
+    with open(cl) as f:
+        cases = [line.strip() for line in f if line.strip()]
+
+    # canonicalize to absolute paths once here rather than in every stage,
+    # and drop duplicate lines (dict.fromkeys dedups while keeping order) so
+    # no case is extracted or registered twice
+    cases = list(dict.fromkeys(os.path.abspath(case) for case in cases))
+
+    # a caselist with no non-blank lines has nothing to run on either path;
+    # exit here so --force cannot carry an empty list into the stages
+    if not cases:
+        print('Caselist is empty, nothing to do')
+        sys.exit(0)
+
+    missing = [case for case in cases if not os.path.isfile(case)]
+    if missing:
+        for case in missing:
+            print("File not found ", case)
+        sys.exit(1)
+
+    if not force:
+        done = [case for case in cases if os.path.exists(expected_mask(case))]
+        if done:
+            print(f'Skipping {len(done)} case(s) with an existing brain mask')
+            cases = [case for case in cases if case not in set(done)]
+        if not cases:
+            print('All cases already have a brain mask, nothing to do')
+            sys.exit(0)
+
+    tmp = tempfile.NamedTemporaryFile(mode='w', suffix='.txt',
+                                      prefix='caselist_', delete=False)
+    with tmp:
+        tmp.writelines(case + "\n" for case in cases)
+    return tmp.name, cases
+
+
+def run_pipeline(cl, mf, nproc, force=False):
     """ Runs the pipeline on a list of cases.
     The order of the pipeline is:
     1. extractb0.py
@@ -22,39 +124,93 @@ def run_pipeline(cl, mf, nproc):
          path to model folder
     nproc : int
          number of processes to use
+    force : bool
+         rerun cases even if their final brain mask already exists
     """
-    t0 = datetime.datetime.now()
-    # use subprocess to run the pipeline
-    subprocess.run(["python", "extractb0.py", "-i", cl, "-nproc", str(abs(nproc-2))])
-    subprocess.run(["python", "antsRegistration.py", "-i", cl, "-f", mf, "-nproc", str(nproc)])
-    subprocess.run(["python", "maskprocessing.py", "-i", cl, "-f", mf])
-    subprocess.run(["python", "postprocessing.py", "-i", cl])
+    t0 = time.perf_counter()
+    # validate every case path up front and give the stages the checked copy
+    cl, cases = prepare_caselist(cl, force)
+
+    # never fork more stage workers than there are cases; on the common
+    # single-subject invocation this keeps each stage's Pool to one worker
+    # instead of spinning up (and tearing down) idle processes
+    nproc = min(nproc, len(cases)) or 1
+    # cap the BLAS/ITK thread pools each stage worker spins up: with nproc
+    # workers per stage and every worker defaulting its OpenMP/ITK pool to
+    # all cores, an 8-core box ends up scheduling 64 threads of
+    # registration work; dividing the cores among the workers keeps the
+    # total at the machine size. maskprocessing and postprocessing run as a
+    # single process, so they get the whole allocation instead
+    def thread_env(threads):
+        env = os.environ.copy()
+        env.update({
+            "OMP_NUM_THREADS": str(threads),
+            "MKL_NUM_THREADS": str(threads),
+            "OPENBLAS_NUM_THREADS": str(threads),
+            "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS": str(threads),
+        })
+        return env
+
+    available_cores = len(os.sched_getaffinity(0))
+    pooled_env = thread_env(max(1, available_cores // nproc))
+    serial_env = thread_env(available_cores)
 
-    # print the total time taken to run the pipeline and memory usage
-    t1 = datetime.datetime.now()
-    print("Total time taken to run the pipeline: ", t1 - t0)
-    print("Memory usage: ", os.popen('ps -o rss= -p %d' % os.getpid()).read())
+    # one shared error log for the run, opened once with a 64 KiB buffer so
+    # the per-line writes batch into page-sized chunks instead of a syscall
+    # per warning
+    err_log = open(os.path.join(os.path.dirname(cases[0]),
+                                "run_pipeline_errors.log"),
+                   "a", buffering=64 * 1024)
+
+    # use subprocess to run the pipeline; sys.executable pins the children
+    # to this exact interpreter instead of whatever `python` resolves to on
+    # the PATH (a different venv, or Python 2). Each stage's output is
+    # streamed through a pipe: everything still echoes to the terminal, and
+    # error/warning lines are teed into the shared log
+    def stage(script, *extra, env=pooled_env):
+        proc = subprocess.Popen([sys.executable,
+                                 os.path.join(SCRIPT_DIR, script),
+                                 "-i", cl] + list(extra),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True, bufsize=1,
+                                env=env)
+        for line in proc.stdout:
+            print(line, end='')
+            if line.startswith(("ERROR", "Error", "WARN", "Warning")):
+                err_log.write(f'{script}: {line}')
+        proc.wait()
+
+    # extractb0 is I/O-bound (nibabel load + b0 write), so more than a few
+    # workers just queue on the disk; antsRegistration is CPU-bound and gets
+    # the full worker count. The old abs(nproc-2) arithmetic collapsed both
+    # nproc=0 and nproc=4 to 2 workers and shrank as cores grew.
+    io_nproc = min(nproc, 4)
+    stage("extractb0.py", "-nproc", str(io_nproc))
+    stage("antsRegistration.py", "-f", mf, "-nproc", str(nproc))
+    stage("maskprocessing.py", "-f", mf, env=serial_env)
+    stage("postprocessing.py", env=serial_env)
+    err_log.close()
+
+    # print the total time taken to run the pipeline and memory usage;
+    # getrusage reads the peak RSS in-process instead of forking a shell
+    # and ps just to pipe back one integer
+    t1 = time.perf_counter()
+    print("Total time taken to run the pipeline: ", round(t1 - t0, 2), " seconds")
+    print("Memory usage (KB): ", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        description=textwrap.dedent('''\
-            This script runs the pipeline on a list of cases.
-            The order of the pipeline is:
-            1. extractb0.py
-            2. antsRegistration.py
-            3. maskprocessing.py
-            4. postprocessing.py
-
-            Example:
-            python run_pipeline.py -i /path/to/caselist.txt -f /path/to/model_folder
-            '''))
-    parser.add_argument('-i', action='store', dest='caselist', type=str,
+        description=DESCRIPTION)
+    parser.add_argument('-i', action='store', dest='caselist', type=existing_path,
                         help="txt file containing list of /path/to/dwi, one path in each line")
-    parser.add_argument('-f', action='store', dest='model_folder', type=str,
+    parser.add_argument('-f', action='store', dest='model_folder', type=existing_path,
                         help="folder containing the trained models")
     parser.add_argument('-nproc', type=int, default=8, help='number of processes to use')
+    parser.add_argument('--force', action='store_true', dest='force',
+                        help='rerun cases even if their brain mask already exists')
 
     try:
         args = parser.parse_args()
@@ -66,28 +222,11 @@ if __name__ == "__main__":
     except SystemExit:
         sys.exit(0)
 
-    if args.nproc > os.cpu_count():
-        print(f'Warning: npoc is greater than the number of cores available. Setting npoc to {os.cpu_count()}')
-        args.nproc = os.cpu_count()
-
-    caselist = None
-    model_folder = None
-
-    if args.caselist:
-        f = pathlib.Path(args.caselist)
-        if f.exists():
-            print("File exist")
-            caselist = args.caselist
-        else:
-            print("File not found")
-            sys.exit(1)
-    if args.model_folder:
-        f = pathlib.Path(args.model_folder)
-        if f.exists():
-            print("File exist")
-            model_folder = args.model_folder
-        else:
-            print("File not found")
-            sys.exit(1)
-
-    run_pipeline(caselist, model_folder, args.nproc)
+    # sched_getaffinity honors cgroup/taskset limits (a SLURM allocation of
+    # 4 cores on a 64-core node), where cpu_count reports the whole machine
+    available_cores = len(os.sched_getaffinity(0))
+    if args.nproc > available_cores:
+        print(f'Warning: nproc is greater than the number of cores available. Setting nproc to {available_cores}')
+        args.nproc = available_cores
+
+    run_pipeline(args.caselist, args.model_folder, args.nproc, args.force)